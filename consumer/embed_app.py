@@ -1,9 +1,17 @@
 from celery import Celery
+from kombu import Queue
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import PointStruct, VectorParams, Distance
+from qdrant_client.http.models import (
+    PointStruct, VectorParams, Distance,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType
+)
 from qdrant_client.http.exceptions import UnexpectedResponse
 from fastembed import TextEmbedding
+from collections import OrderedDict
+import hashlib
 import logging
+import os
+import uuid
 import numpy as np
 
 # Set up logging
@@ -17,18 +25,53 @@ app = Celery(
     backend='rpc://'
 )
 
-# Configure Celery
+# Configure Celery; chunk_content_queue is transient (durable=False) so
+# RabbitMQ skips the per-publish fsync — chunks are re-derivable from S3,
+# so losing queued messages on a broker restart is acceptable. Brokers that
+# still have the old durable queue reject this declaration (AMQP 406);
+# delete the queue once before rollout, see the README's RabbitMQ section
 app.conf.update(
     task_serializer='json',
     accept_content=['json'],
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    task_queues=(
+        Queue(
+            'chunk_content_queue',
+            routing_key='chunk_content_queue',
+            durable=False,
+            queue_arguments={'x-queue-type': 'classic'}
+        ),
+    ),
+    task_routes={
+        'embed_app.bulk_load_doc': {'queue': 'chunk_content_queue'},
+        'embed_app.store_chunk_batch': {'queue': 'chunk_content_queue'},
+    },
+    # Embed tasks are long-running: prefetch one message at a time and ack
+    # after completion so a slow batch never holds others hostage in a
+    # worker's local queue, and recycle children to bound memory growth
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    worker_max_tasks_per_child=500,
+    worker_concurrency=os.cpu_count(),
 )
 
-# Initialize Qdrant client
+# Initialize Qdrant client; gRPC sends vectors as binary float32 instead of
+# JSON, cutting serialization CPU and bytes on the wire. Keepalive pings hold
+# the channel open across idle periods so calls skip connection ramp-up
 try:
-    qdrant_client = QdrantClient(url='http://qdrant.qdrant.svc.cluster.local:6333', timeout=10)
+    qdrant_client = QdrantClient(
+        host='qdrant.qdrant.svc.cluster.local',
+        grpc_port=6334,
+        prefer_grpc=True,
+        timeout=30,
+        grpc_options={
+            'grpc.keepalive_time_ms': 20000,
+            'grpc.keepalive_timeout_ms': 10000,
+            'grpc.http2.max_pings_without_data': 0,
+        }
+    )
     logger.info("Successfully connected to Qdrant")
 except Exception as e:
     logger.error(f"Failed to connect to Qdrant: {e}")
@@ -40,7 +83,18 @@ try:
     if 'test_collection' not in [c.name for c in collections.collections]:
         qdrant_client.create_collection(
             collection_name='test_collection',
-            vectors_config=VectorParams(size=384, distance=Distance.COSINE)
+            # Vectors are L2-normalized client-side, so dot product equals cosine
+            # without the per-candidate renorm in the scoring loop
+            vectors_config=VectorParams(size=384, distance=Distance.DOT),
+            # Scalar int8 quantization keeps a 384-byte copy of each vector
+            # in RAM, quartering the bytes scanned per scored candidate
+            quantization_config=ScalarQuantization(
+                scalar=ScalarQuantizationConfig(
+                    type=ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
+            )
         )
         logger.info("Created test_collection with vector size 384")
     else:
@@ -49,55 +103,186 @@ except Exception as e:
     logger.error(f"Failed to ensure Qdrant collection: {e}")
     raise
 
-# Initialize FastEmbed model
+# Initialize FastEmbed model, pinning ONNXRuntime intra-op threads to the
+# CPU count; fastembed exposes no way to pick the int8 model file, so this
+# runs the default ONNX weights it ships for MiniLM
 try:
-    embedding_model = TextEmbedding("sentence-transformers/all-MiniLM-L6-v2")
+    embedding_model = TextEmbedding(
+        "sentence-transformers/all-MiniLM-L6-v2",
+        providers=[("CPUExecutionProvider", {"intra_op_num_threads": os.cpu_count()})],
+        threads=os.cpu_count()
+    )
     logger.info("Successfully initialized FastEmbed model")
 except Exception as e:
     logger.error(f"Failed to initialize FastEmbed model: {e}")
     raise
 
-@app.task(name='embed_app.store_chunk_content')
-def store_pdf_content(doc_id, chunk_id, text):
-    """Task to generate embeddings and store in Qdrant"""
-    logger.info(f"Task embed_app.store_chunk_content received for doc_id {doc_id}, chunk_id {chunk_id}, text length: {len(text)}")
+
+def normalize_vectors(vectors):
+    """L2-normalize embedding rows to float32 so dot product equals cosine"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / (np.linalg.norm(vectors, axis=-1, keepdims=True) + 1e-12)
+
+
+# In-process LRU of content-hash -> embedding, so boilerplate paragraphs
+# (headers, footers, "Page X of Y") repeated across documents are embedded
+# once per worker instead of once per occurrence
+_EMBED_CACHE_MAX = 8192
+_embed_cache = OrderedDict()
+
+
+def _text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+
+
+def embed_texts(texts, batch_size):
+    """Embed texts, reusing cached vectors for already-seen content.
+
+    Only cache misses go through the MiniLM forward pass; the returned
+    matrix keeps the input order and rows are normalized float32.
+    """
+    hashes = [_text_hash(text) for text in texts]
+    vectors = {}
+    miss_indices = []
+    for index, h in enumerate(hashes):
+        if h in _embed_cache:
+            _embed_cache.move_to_end(h)
+            vectors[h] = _embed_cache[h]
+        elif h not in vectors:
+            vectors[h] = None
+            miss_indices.append(index)
+
+    if miss_indices:
+        new_vectors = normalize_vectors(np.stack(list(embedding_model.embed(
+            [texts[i] for i in miss_indices], batch_size=batch_size
+        ))))
+        for index, vector in zip(miss_indices, new_vectors):
+            vectors[hashes[index]] = vector
+            _embed_cache[hashes[index]] = vector
+        while len(_embed_cache) > _EMBED_CACHE_MAX:
+            _embed_cache.popitem(last=False)
+
+    if len(miss_indices) < len(texts):
+        logger.info(f"Embedding cache reused {len(texts) - len(miss_indices)} of {len(texts)} texts")
+    return np.stack([vectors[h] for h in hashes])
+
+
+@app.task(name='embed_app.bulk_load_doc')
+def bulk_load_doc(doc_id, s3_key, chunks):
+    """Task to bulk-load all chunks of a document into Qdrant.
+
+    upload_collection amortizes the HTTP round-trip and WAL-sync latency of
+    per-chunk upsert calls across the whole document and pipelines requests
+    over parallel workers, so this is the preferred path for whole-document
+    ingestion; store_chunk_batch remains for incremental updates.
+
+    Payloads store only where each chunk lives in S3 (s3_key, offset,
+    length) rather than the text itself, keeping paragraph bytes out of
+    Qdrant's payload storage; the query service re-fetches text with
+    ranged GETs.
+    """
+    logger.info(f"Task embed_app.bulk_load_doc received for doc_id {doc_id}, {len(chunks)} chunks")
     try:
         # Validate inputs
         if not isinstance(doc_id, str):
             logger.error(f"Invalid doc_id type: {type(doc_id)}, value: {doc_id}")
             raise ValueError(f"doc_id must be a string, got {type(doc_id)}")
-        if not isinstance(chunk_id, str):
-            logger.error(f"Invalid chunk_id type: {type(chunk_id)}, value: {chunk_id}")
-            raise ValueError(f"chunk_id must be a string, got {type(chunk_id)}")
-
-        # Generate embedding for the text
-        logger.info(f"Generating embedding for chunk_id {chunk_id}")
-        embeddings = list(embedding_model.embed([text]))[0]
-        embedding_vector = embeddings.tolist()  # Convert to list for Qdrant
-        logger.info(f"Generated embedding for chunk_id {chunk_id}, vector length: {len(embedding_vector)}")
-
-        # Validate embedding vector
-        if len(embedding_vector) != 384:
-            logger.error(f"Invalid embedding vector length: {len(embedding_vector)}, expected 384")
-            raise ValueError(f"Embedding vector length {len(embedding_vector)} does not match expected 384")
-
-        # Upsert into Qdrant
-        logger.info(f"Upserting embedding for chunk_id {chunk_id} into Qdrant")
+        if not isinstance(chunks, list) or not all(isinstance(c, dict) for c in chunks):
+            logger.error(f"Invalid chunks type: {type(chunks)}")
+            raise ValueError("chunks must be a list of dicts with 'text', 'offset' and 'length' keys")
+        if not chunks:
+            logger.info(f"No chunks to load for doc_id {doc_id}")
+            return
+
+        # Generate embeddings for all chunk texts in one batched forward pass
+        logger.info(f"Generating embeddings for {len(chunks)} chunks of doc_id {doc_id}")
+        vectors = list(embed_texts([c['text'] for c in chunks], batch_size=64))
+        logger.info(f"Generated {len(vectors)} embeddings for doc_id {doc_id}")
+
+        # Bulk-upload all points in 256-point batches without waiting for WAL
+        # sync. parallel must stay 1: higher values spawn multiprocessing
+        # children, which daemonic Celery prefork workers are not allowed to do
+        logger.info(f"Bulk-uploading {len(vectors)} embeddings for doc_id {doc_id} into Qdrant")
+        qdrant_client.upload_collection(
+            collection_name='test_collection',
+            vectors=vectors,
+            payload=[
+                {"doc_id": doc_id, "s3_key": s3_key, "offset": c['offset'], "length": c['length']}
+                for c in chunks
+            ],
+            ids=[str(uuid.uuid4()) for _ in chunks],
+            parallel=1,
+            batch_size=256,
+            wait=False
+        )
+        logger.info(f"Successfully bulk-uploaded {len(vectors)} embeddings for doc_id {doc_id} into Qdrant")
+
+    except UnexpectedResponse as e:
+        logger.error(f"Qdrant API error for doc_id {doc_id}: status={e.status_code}, details={str(e)}")
+        raise
+    except Exception as e:
+        logger.error(f"Failed to bulk-load doc_id {doc_id}: {e}")
+        raise
+
+
+@app.task(name='embed_app.store_chunk_batch')
+def store_chunk_batch(doc_id, s3_key, chunks):
+    """Task to generate embeddings for a batch of chunks and store them in Qdrant.
+
+    Embedding one chunk per Celery message pays the model and HTTP call
+    overhead for every paragraph, so the publisher now ships all chunks of a
+    document in one message and we embed and upsert them in a single pass.
+    Like bulk_load_doc, payloads store the chunk's S3 location instead of
+    its text.
+    """
+    logger.info(f"Task embed_app.store_chunk_batch received for doc_id {doc_id}, {len(chunks)} chunks")
+    try:
+        # Validate inputs
+        if not isinstance(doc_id, str):
+            logger.error(f"Invalid doc_id type: {type(doc_id)}, value: {doc_id}")
+            raise ValueError(f"doc_id must be a string, got {type(doc_id)}")
+        if not isinstance(chunks, list) or not all(isinstance(c, dict) for c in chunks):
+            logger.error(f"Invalid chunks type: {type(chunks)}")
+            raise ValueError("chunks must be a list of dicts with 'id', 'text', 'offset' and 'length' keys")
+        if not chunks:
+            logger.info(f"No chunks to store for doc_id {doc_id}")
+            return
+
+        # Generate embeddings for all chunk texts in one batched forward pass
+        logger.info(f"Generating embeddings for {len(chunks)} chunks of doc_id {doc_id}")
+        vectors = embed_texts([c['text'] for c in chunks], batch_size=32)
+        logger.info(f"Generated embeddings for doc_id {doc_id}, shape: {vectors.shape}")
+
+        # Validate embedding dimensions
+        if vectors.shape[1] != 384:
+            logger.error(f"Invalid embedding vector length: {vectors.shape[1]}, expected 384")
+            raise ValueError(f"Embedding vector length {vectors.shape[1]} does not match expected 384")
+
+        # Upsert all points into Qdrant in a single request
+        logger.info(f"Upserting {len(chunks)} embeddings for doc_id {doc_id} into Qdrant")
+        points = [
+            PointStruct(
+                id=chunk['id'],  # Use chunk_id as the unique point ID
+                vector=vector,
+                payload={
+                    "doc_id": doc_id,
+                    "s3_key": s3_key,
+                    "offset": chunk['offset'],
+                    "length": chunk['length'],
+                }
+            )
+            for chunk, vector in zip(chunks, vectors)
+        ]
         qdrant_client.upsert(
             collection_name='test_collection',
-            points=[
-                PointStruct(
-                    id=chunk_id,  # Use chunk_id as the unique point ID
-                    vector=embedding_vector,
-                    payload={"doc_id": doc_id, "text": text}
-                )
-            ]
+            points=points,
+            wait=False
         )
-        logger.info(f"Successfully upserted embedding for chunk_id {chunk_id} into Qdrant")
+        logger.info(f"Successfully upserted {len(points)} embeddings for doc_id {doc_id} into Qdrant")
 
     except UnexpectedResponse as e:
-        logger.error(f"Qdrant API error for chunk_id {chunk_id}: status={e.status_code}, details={str(e)}")
+        logger.error(f"Qdrant API error for doc_id {doc_id}: status={e.status_code}, details={str(e)}")
         raise
     except Exception as e:
-        logger.error(f"Failed to store content for chunk_id {chunk_id}: {e}")
+        logger.error(f"Failed to store chunk batch for doc_id {doc_id}: {e}")
         raise
\ No newline at end of file
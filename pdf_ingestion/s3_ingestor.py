@@ -1,8 +1,15 @@
 import boto3
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+# Files above 8 MiB are split into concurrent multipart uploads
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 << 20, max_concurrency=10)
+
 
 def create_s3_bucket(s3_client, bucket_name, region="us-east-2"):
     """Create an S3 bucket in the specified region."""
@@ -25,6 +32,25 @@ def create_s3_bucket(s3_client, bucket_name, region="us-east-2"):
         return False
 
 
+def upload_one_txt_file(s3_client, bucket_name, full_path, file):
+    """Upload a single TXT file under a UUID S3 object key."""
+    unique_id = str(uuid.uuid4())
+    s3_key = f"{unique_id}.txt"
+    try:
+        s3_client.upload_file(
+            Filename=full_path,
+            Bucket=bucket_name,
+            Key=s3_key,
+            ExtraArgs={"ContentType": "text/plain"},
+            Config=TRANSFER_CONFIG
+        )
+        print(f"Uploaded '{file}' as '{s3_key}' to 's3://{bucket_name}/{s3_key}'")
+        return True
+    except ClientError as e:
+        print(f"Error uploading '{file}': {e}")
+        return False
+
+
 def upload_txt_files_with_uuid(s3_client, bucket_name, local_directory):
     """Upload only top-level TXT files using UUIDs as S3 object keys."""
     try:
@@ -32,24 +58,22 @@ def upload_txt_files_with_uuid(s3_client, bucket_name, local_directory):
             print(f"Directory '{local_directory}' does not exist.")
             return False
 
-        for file in os.listdir(local_directory):
-            full_path = os.path.join(local_directory, file)
-            if os.path.isfile(full_path) and file.lower().endswith(".txt"):
-                unique_id = str(uuid.uuid4())
-                s3_key = f"{unique_id}.txt"
-
-                try:
-                    s3_client.upload_file(
-                        Filename=full_path,
-                        Bucket=bucket_name,
-                        Key=s3_key,
-                        ExtraArgs={"ContentType": "text/plain"}
-                    )
-                    print(f"Uploaded '{file}' as '{s3_key}' to 's3://{bucket_name}/{s3_key}'")
-                except ClientError as e:
-                    print(f"Error uploading '{file}': {e}")
-                    return False
-        return True
+        # scandir returns cached stat info per DirEntry, so filtering large
+        # directories avoids one stat syscall and one path join per entry
+        with os.scandir(local_directory) as it:
+            entries = [
+                (entry.path, entry.name) for entry in it
+                if entry.is_file(follow_symlinks=False) and entry.name.lower().endswith(".txt")
+            ]
+
+        # Uploads are network-bound, so run them across a thread pool;
+        # large files additionally use concurrent multipart parts
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                executor.submit(upload_one_txt_file, s3_client, bucket_name, full_path, file)
+                for full_path, file in entries
+            ]
+            return all(f.result() for f in futures)
     except Exception as e:
         print(f"Error processing directory '{local_directory}': {e}")
         return False
@@ -61,9 +85,13 @@ def main():
     region = "us-east-2"
     local_directory = os.path.join(os.getcwd(), "sample_pdfs")  # Only top-level files in this folder
 
-    # Initialize S3 client
+    # Initialize S3 client with a pool sized for concurrent uploads
     try:
-        s3_client = boto3.client("s3", region_name=region)
+        s3_client = boto3.client(
+            "s3",
+            region_name=region,
+            config=Config(max_pool_connections=64, retries={"mode": "adaptive"})
+        )
     except Exception as e:
         print(f"Error initializing S3 client: {e}")
         return
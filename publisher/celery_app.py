@@ -1,10 +1,18 @@
+import io
 import os
-import uuid
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from celery import Celery
+from kombu import Queue
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, MatchValue, VectorParams, Distance
+from qdrant_client.http.models import (
+    Filter, FieldCondition, MatchAny, VectorParams, Distance, OptimizersConfigDiff,
+    PayloadSchemaType, ScalarQuantization, ScalarQuantizationConfig, ScalarType
+)
 import logging
 
 # Set up logging
@@ -18,26 +26,69 @@ app = Celery(
     backend='rpc://'
 )
 
-# Configure Celery
+# Configure Celery; chunk_content_queue is transient (durable=False) so
+# RabbitMQ skips the per-publish fsync — chunks are re-derivable from S3,
+# so losing queued messages on a broker restart is acceptable. Brokers that
+# still have the old durable queue reject this declaration (AMQP 406);
+# delete the queue once before rollout, see the README's RabbitMQ section
 app.conf.update(
     task_serializer='json',
     accept_content=['json'],
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    task_queues=(
+        Queue(
+            'chunk_content_queue',
+            routing_key='chunk_content_queue',
+            durable=False,
+            queue_arguments={'x-queue-type': 'classic'}
+        ),
+    ),
+    task_routes={
+        'embed_app.bulk_load_doc': {'queue': 'chunk_content_queue'},
+        'embed_app.store_chunk_batch': {'queue': 'chunk_content_queue'},
+    },
+)
+
+# Transfer config for S3 downloads: files above 8 MiB are fetched as
+# concurrent ranged GETs so throughput tracks bandwidth rather than
+# single-stream round-trip latency
+_TRANSFER_CFG = TransferConfig(
+    multipart_threshold=8 << 20,
+    multipart_chunksize=8 << 20,
+    max_concurrency=10,
+    io_chunksize=1 << 20,
+    use_threads=True
 )
 
-# Initialize AWS S3 client
+# Initialize AWS S3 client with a pool large enough for the worker threads
 try:
-    s3_client = boto3.client('s3', region_name='us-east-2')
+    s3_client = boto3.client(
+        's3',
+        region_name='us-east-2',
+        config=Config(max_pool_connections=32)
+    )
     logger.info("Successfully initialized S3 client")
 except Exception as e:
     logger.error(f"Failed to initialize S3 client: {e}")
     raise
 
-# Initialize Qdrant client
+# Initialize Qdrant client; gRPC sends vectors as binary float32 instead of
+# JSON, cutting serialization CPU and bytes on the wire. Keepalive pings hold
+# the channel open across idle periods so calls skip connection ramp-up
 try:
-    qdrant_client = QdrantClient(url='http://qdrant.qdrant.svc.cluster.local:6333', timeout=10)
+    qdrant_client = QdrantClient(
+        host='qdrant.qdrant.svc.cluster.local',
+        grpc_port=6334,
+        prefer_grpc=True,
+        timeout=30,
+        grpc_options={
+            'grpc.keepalive_time_ms': 20000,
+            'grpc.keepalive_timeout_ms': 10000,
+            'grpc.http2.max_pings_without_data': 0,
+        }
+    )
     logger.info("Successfully connected to Qdrant")
 except Exception as e:
     logger.error(f"Failed to connect to Qdrant: {e}")
@@ -49,86 +100,182 @@ try:
     if 'test_collection' not in [c.name for c in collections.collections]:
         qdrant_client.create_collection(
             collection_name='test_collection',
-            vectors_config=VectorParams(size=384, distance=Distance.COSINE)
+            # Vectors are L2-normalized client-side, so dot product equals cosine
+            # without the per-candidate renorm in the scoring loop
+            vectors_config=VectorParams(size=384, distance=Distance.DOT),
+            # Scalar int8 quantization keeps a 384-byte copy of each vector
+            # in RAM, quartering the bytes scanned per scored candidate
+            quantization_config=ScalarQuantization(
+                scalar=ScalarQuantizationConfig(
+                    type=ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
+            )
         )
         logger.info("Created test_collection with vector size 384")
     else:
         logger.info("test_collection already exists")
+    # Index doc_id so dedupe filters hit an index instead of a full scan
+    qdrant_client.create_payload_index(
+        collection_name='test_collection',
+        field_name='doc_id',
+        field_schema=PayloadSchemaType.KEYWORD
+    )
 except Exception as e:
     logger.error(f"Failed to ensure Qdrant collection: {e}")
     raise
 
 
+# Paragraph separator: blank line, possibly containing spaces/tabs.
+# Compiled once and applied to raw bytes so splitting and stripping run in C
+# instead of a per-paragraph Python loop.
+_PARA_RE = re.compile(rb'\n[ \t]*\n')
+
+
+def _make_chunk(file_content, start, end):
+    """Build a chunk dict for the paragraph spanning [start, end) bytes,
+    or None if the span is only whitespace. offset/length describe the
+    stripped paragraph within the original object so the text can later be
+    re-fetched with a ranged GET instead of being stored in Qdrant."""
+    raw = file_content[start:end]
+    stripped = raw.strip()
+    if not stripped:
+        return None
+    left_pad = len(raw) - len(raw.lstrip())
+    return {
+        'text': stripped.decode('utf-8', 'replace'),
+        'offset': start + left_pad,
+        'length': len(stripped),
+    }
+
+
 def parse_text(file_content):
-    """Parse text content into paragraph chunks"""
+    """Parse text content into paragraph chunks with byte offsets"""
     try:
-        # Decode bytes to string
-        text = file_content.decode('utf-8')
-        # Split into paragraphs (using double newline as separator)
-        paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-        return paragraphs
+        chunks = []
+        start = 0
+        for match in _PARA_RE.finditer(file_content):
+            chunk = _make_chunk(file_content, start, match.start())
+            if chunk:
+                chunks.append(chunk)
+            start = match.end()
+        chunk = _make_chunk(file_content, start, len(file_content))
+        if chunk:
+            chunks.append(chunk)
+        return chunks
     except Exception as e:
         logger.error(f"Failed to parse text: {e}")
         raise
 
 
+def existing_doc_ids(candidate_ids):
+    """Return the subset of candidate doc_ids already stored in Qdrant.
+
+    One MatchAny scroll replaces a per-document round-trip, so dedupe cost
+    is a single request per batch of candidates rather than N requests.
+    """
+    if not candidate_ids:
+        return set()
+    existing = set()
+    offset = None
+    while True:
+        hits, offset = qdrant_client.scroll(
+            collection_name='test_collection',
+            scroll_filter=Filter(
+                must=[
+                    FieldCondition(
+                        key='doc_id',
+                        match=MatchAny(any=list(candidate_ids))
+                    )
+                ]
+            ),
+            with_payload=['doc_id'],
+            with_vectors=False,
+            limit=len(candidate_ids),
+            offset=offset
+        )
+        existing.update(h.payload['doc_id'] for h in hits)
+        if offset is None or len(existing) == len(candidate_ids):
+            return existing
+
+
 @app.task(name='celery_app.process_s3_text')
 def process_s3_text(bucket_name='my-unique-bucket-2025123243'):
     """Celery task to process text files in S3 bucket"""
     logger.info(f"Starting task process_s3_text for bucket {bucket_name}")
     try:
-        # List text files in S3 bucket
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix='', Delimiter='/')
-        text_files = [
-            obj['Key'] for obj in response.get('Contents', [])
-            if obj['Key'].endswith('.txt')
-        ]
-        logger.info(f"Found {len(text_files)} text files in bucket {bucket_name}")
-
-        for text_key in text_files:
-            # Extract doc_id from filename (e.g., 'test_file' from 'test_file.txt')
-            doc_id = os.path.splitext(text_key)[0]
-            logger.info(f"Checking {text_key} with doc_id {doc_id}")
+        # Disable HNSW indexing while the bulk load runs so writes only pay
+        # WAL+flush cost; the index is rebuilt once the threshold is restored
+        qdrant_client.update_collection(
+            collection_name='test_collection',
+            optimizer_config=OptimizersConfigDiff(indexing_threshold=0)
+        )
+        logger.info("Disabled indexing on test_collection for bulk load")
 
-            # Check if doc_id exists in Qdrant (any chunk with this doc_id)
-            search_result = qdrant_client.scroll(
-                collection_name='test_collection',
-                scroll_filter=Filter(
-                    must=[
-                        FieldCondition(
-                            key='doc_id',
-                            match=MatchValue(value=doc_id)
-                        )
-                    ]
-                ),
-                limit=1
-            )
+        # List text files page by page; a bare list_objects_v2 call caps out
+        # at 1000 keys and would silently miss the rest
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=bucket_name,
+            Prefix='',
+            PaginationConfig={'PageSize': 1000}
+        )
+
+        def iter_new_txt_keys():
+            # Yield keys as pages arrive so listing, dedupe and downloads
+            # overlap instead of materializing every key up front
+            for page in pages:
+                keys = [
+                    obj['Key'] for obj in page.get('Contents', [])
+                    if obj['Key'].endswith('.txt')
+                ]
+                if not keys:
+                    continue
+                logger.info(f"Listed page of {len(keys)} text files in bucket {bucket_name}")
+                # Probe Qdrant once per page instead of once per file
+                # (doc_id is e.g. 'test_file' from 'test_file.txt')
+                existing = existing_doc_ids({os.path.splitext(k)[0] for k in keys})
+                if existing:
+                    logger.info(f"Skipping {len(existing)} doc_ids already in Qdrant")
+                yield from (k for k in keys if os.path.splitext(k)[0] not in existing)
 
-            if search_result[0]:  # doc_id exists in Qdrant
-                logger.info(f"Skipping {text_key}: doc_id {doc_id} already in Qdrant")
-                continue
+        def _process_one(text_key):
+            doc_id = os.path.splitext(text_key)[0]
 
             # Download and parse text file
             logger.info(f"Processing {text_key}")
-            obj = s3_client.get_object(Bucket=bucket_name, Key=text_key)
-            text_content = obj['Body'].read()
-            paragraphs = parse_text(text_content)
-
-            # Process each paragraph chunk
-            for index, text in enumerate(paragraphs):
-                chunk_id = str(uuid.uuid4())
-                logger.info(f"Sending chunk {chunk_id} for {text_key}, text length: {len(text)}")
-                # Publish chunk to RabbitMQ queue
-                app.send_task(
-                    'embed_app.store_chunk_content',
-                    args=(doc_id, chunk_id, text),
-                    queue='chunk_content_queue'
-                )
-                logger.info(f"Sent chunk {chunk_id} for {text_key} to chunk_content_queue")
+            buf = io.BytesIO()
+            s3_client.download_fileobj(bucket_name, text_key, buf, Config=_TRANSFER_CFG)
+            chunks = parse_text(buf.getvalue())
+
+            # Send the whole document to the bulk loader in one message
+            logger.info(f"Sending {len(chunks)} chunks for {text_key} to bulk loader")
+            app.send_task(
+                'embed_app.bulk_load_doc',
+                args=(doc_id, text_key, chunks)
+            )
+            logger.info(f"Sent {len(chunks)} chunks for {text_key} to chunk_content_queue")
+
+        # The per-file work is I/O-bound (S3 GET, Qdrant scroll, AMQP publish),
+        # so overlap it across a thread pool; boto3 clients and the Qdrant
+        # client are both thread-safe for these calls
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(_process_one, iter_new_txt_keys()))
 
     except Exception as e:
         logger.error(f"Error processing text files: {e}")
         raise
+    finally:
+        # Restore the indexing threshold once all batches have been dispatched
+        try:
+            qdrant_client.update_collection(
+                collection_name='test_collection',
+                optimizer_config=OptimizersConfigDiff(indexing_threshold=20000)
+            )
+            logger.info("Re-enabled indexing on test_collection after bulk load")
+        except Exception as e:
+            logger.error(f"Failed to re-enable indexing on test_collection: {e}")
 
 
 def trigger_process():
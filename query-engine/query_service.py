@@ -1,9 +1,21 @@
 from flask import Flask, request, jsonify
 from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    SearchRequest, SearchParams, QuantizationSearchParams
+)
 from fastembed import TextEmbedding
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.config import Config
 import logging
+import os
 import numpy as np
 
+# Bucket holding the source documents; point payloads reference chunks as
+# (s3_key, offset, length) into these objects
+S3_BUCKET = 'my-unique-bucket-2025123243'
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -11,23 +23,104 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 
-# Initialize Qdrant client
+# Initialize AWS S3 client for fetching chunk text; pool sized for the
+# per-request ranged-GET fan-out
+try:
+    s3_client = boto3.client('s3', region_name='us-east-2', config=Config(max_pool_connections=32))
+    logger.info("Successfully initialized S3 client")
+except Exception as e:
+    logger.error(f"Failed to initialize S3 client: {e}")
+    raise
+
+# Initialize Qdrant client; gRPC sends vectors as binary float32 instead of
+# JSON, cutting serialization CPU and bytes on the wire. Keepalive pings hold
+# the channel open across idle periods so calls skip connection ramp-up
 try:
-    qdrant_client = QdrantClient(url='http://qdrant.qdrant.svc.cluster.local:6333', timeout=10)
+    qdrant_client = QdrantClient(
+        host='qdrant.qdrant.svc.cluster.local',
+        grpc_port=6334,
+        prefer_grpc=True,
+        timeout=30,
+        grpc_options={
+            'grpc.keepalive_time_ms': 20000,
+            'grpc.keepalive_timeout_ms': 10000,
+            'grpc.http2.max_pings_without_data': 0,
+        }
+    )
+    # Warm the channel at startup so the first search skips connection setup
+    qdrant_client.get_collections()
     logger.info("Successfully connected to Qdrant")
 except Exception as e:
     logger.error(f"Failed to connect to Qdrant: {e}")
     raise
 
-# Initialize FastEmbed model
+# Initialize FastEmbed model, pinning ONNXRuntime intra-op threads to the
+# CPU count; fastembed exposes no way to pick the int8 model file, so this
+# runs the default ONNX weights it ships for MiniLM
 try:
-    embedding_model = TextEmbedding("sentence-transformers/all-MiniLM-L6-v2")
+    embedding_model = TextEmbedding(
+        "sentence-transformers/all-MiniLM-L6-v2",
+        providers=[("CPUExecutionProvider", {"intra_op_num_threads": os.cpu_count()})],
+        threads=os.cpu_count()
+    )
     logger.info("Successfully initialized FastEmbed model")
 except Exception as e:
     logger.error(f"Failed to initialize FastEmbed model: {e}")
     raise
 
 
+def _normalize(vectors):
+    """L2-normalize embedding rows to float32 to match the stored vectors;
+    the collection uses dot-product distance, which equals cosine on
+    unit-length vectors."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / (np.linalg.norm(vectors, axis=-1, keepdims=True) + 1e-12)
+
+
+def _fetch_chunk_text(payload):
+    """Fetch one chunk's text from S3 using the ranged-GET coordinates in
+    its payload; falls back to an inline 'text' field for points written
+    before text was moved out of Qdrant."""
+    s3_key = payload.get("s3_key")
+    if not s3_key:
+        return payload.get("text", "")
+    try:
+        offset = int(payload["offset"])
+        length = int(payload["length"])
+        response = s3_client.get_object(
+            Bucket=S3_BUCKET,
+            Key=s3_key,
+            Range=f"bytes={offset}-{offset + length - 1}"
+        )
+        return response['Body'].read().decode('utf-8', 'replace')
+    except Exception as e:
+        logger.error(f"Failed to fetch chunk text from s3://{S3_BUCKET}/{s3_key}: {e}")
+        return ""
+
+
+def _fetch_chunk_texts(payloads):
+    """Fetch chunk texts for a list of payloads with parallel ranged GETs"""
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        return list(executor.map(_fetch_chunk_text, payloads))
+
+
+# Score candidates against the int8-quantized vectors, oversample 2x and
+# rescore the survivors with the original float32 vectors to retain recall
+_SEARCH_PARAMS = SearchParams(
+    quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
+
+
+@lru_cache(maxsize=4096)
+def _embed_query(text):
+    """Embed a single query text, caching repeated queries.
+
+    A cache hit replaces the MiniLM forward pass with an O(1) dict lookup;
+    callers must treat the returned array as read-only since it is shared.
+    """
+    return _normalize(next(iter(embedding_model.embed([text]))))
+
+
 @app.route('/search', methods=['POST'])
 def search():
     """Search Qdrant for top N results based on query text"""
@@ -44,13 +137,15 @@ def search():
         if top_n <= 0:
             return jsonify({"error": "top_n must be a positive integer"}), 400
 
-        # Generate embedding for query text
+        # Generate embedding for query text (cached for repeated queries);
+        # keep the ndarray as-is so the Qdrant client serializes the buffer
+        # instead of a boxed float list
         logger.info(f"Generating embedding for query: {query_text[:50]}...")
-        query_embedding = list(embedding_model.embed([query_text]))[0].tolist()
+        query_embedding = _embed_query(query_text)
 
         # Validate embedding
-        if len(query_embedding) != 384:
-            logger.error(f"Invalid query embedding length: {len(query_embedding)}")
+        if query_embedding.shape != (384,):
+            logger.error(f"Invalid query embedding shape: {query_embedding.shape}")
             return jsonify({"error": "Failed to generate valid query embedding"}), 500
 
         # Search Qdrant
@@ -59,18 +154,20 @@ def search():
             collection_name='test_collection',
             query_vector=query_embedding,
             limit=top_n,
-            with_payload=True
+            with_payload=True,
+            search_params=_SEARCH_PARAMS
         )
 
-        # Format results
+        # Format results, pulling chunk text from S3 in parallel
+        texts = _fetch_chunk_texts([result.payload for result in search_results])
         results = [
             {
                 "doc_id": result.payload.get("doc_id", ""),
                 "chunk_id": result.id,
-                "text": result.payload.get("text", ""),
+                "text": text,
                 "score": float(result.score)
             }
-            for result in search_results
+            for result, text in zip(search_results, texts)
         ]
 
         logger.info(f"Returning {len(results)} results")
@@ -81,5 +178,66 @@ def search():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/search_batch', methods=['POST'])
+def search_batch():
+    """Search Qdrant for top N results for a batch of query texts.
+
+    Embedding all queries in one forward pass raises BLAS utilization over
+    per-request embedding, and search_batch resolves every query in a
+    single Qdrant round-trip.
+    """
+    try:
+        data = request.get_json()
+        if not data or 'query_texts' not in data or 'top_n' not in data:
+            return jsonify({"error": "Missing query_texts or top_n in request body"}), 400
+
+        query_texts = data['query_texts']
+        top_n = int(data['top_n'])
+
+        if (not isinstance(query_texts, list) or not query_texts
+                or not all(isinstance(q, str) and q.strip() for q in query_texts)):
+            return jsonify({"error": "query_texts must be a non-empty list of non-empty strings"}), 400
+        if top_n <= 0:
+            return jsonify({"error": "top_n must be a positive integer"}), 400
+
+        # Generate embeddings for all queries in one batched forward pass
+        logger.info(f"Generating embeddings for {len(query_texts)} queries")
+        query_embeddings = _normalize(np.stack(list(embedding_model.embed(query_texts))))
+
+        # Resolve all queries in a single Qdrant round-trip
+        logger.info(f"Searching Qdrant for top {top_n} results per query")
+        batch_results = qdrant_client.search_batch(
+            collection_name='test_collection',
+            requests=[
+                SearchRequest(vector=vec.tolist(), limit=top_n, with_payload=True, params=_SEARCH_PARAMS)
+                for vec in query_embeddings
+            ]
+        )
+
+        # Format results, one list per query, pulling all chunk texts from
+        # S3 in one parallel pass across the whole batch
+        flat_hits = [result for search_results in batch_results for result in search_results]
+        texts = iter(_fetch_chunk_texts([hit.payload for hit in flat_hits]))
+        results = [
+            [
+                {
+                    "doc_id": result.payload.get("doc_id", ""),
+                    "chunk_id": result.id,
+                    "text": next(texts),
+                    "score": float(result.score)
+                }
+                for result in search_results
+            ]
+            for search_results in batch_results
+        ]
+
+        logger.info(f"Returning results for {len(results)} queries")
+        return jsonify({"results": results}), 200
+
+    except Exception as e:
+        logger.error(f"Batch search error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file